@@ -1,13 +1,28 @@
 #!/usr/bin/env python3
 
-import argparse
+import os
+import select
 import time
-from typing import Optional, Set
-import serial
-from datetime import datetime
-from enum import Enum, auto
+from types import SimpleNamespace
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    ClassVar,
+    Dict,
+    List,
+    Mapping,
+    NoReturn,
+    Optional,
+    Set,
+    Tuple,
+)
+from enum import Enum, IntEnum, auto
 import sys
 
+if TYPE_CHECKING:
+    import serial
+
 
 class Color(Enum):
     Debug = "\033[0;90m"
@@ -18,76 +33,206 @@ class Color(Enum):
         return self.value
 
 
-class OpCode(Enum):
+_DEBUG, _INFO, _TIME, _RESET = (
+    Color.Debug.value,
+    Color.Info.value,
+    Color.Time.value,
+    Color.Reset.value,
+)
+
+
+class OpCode(IntEnum):
     Off = 0x00
     On = 0x01
     OffAck = 0x02
     OnAck = 0x03
     NegateAck = 0x04
     QueryAck = 0x05
-    Unknown = auto()
+    Unknown = 0xFF
+
+
+_OP_BY_VAL: Dict[int, OpCode] = {op: op for op in OpCode if op is not OpCode.Unknown}
+_TIMEOUT: float = 0.5
+_NO_ACK = frozenset({OpCode.Off, OpCode.On})
+_SET_OFF = frozenset({OpCode.Off, OpCode.OffAck})
+_SET_ON = frozenset({OpCode.On, OpCode.OnAck})
+_SET_ACK = frozenset({OpCode.NegateAck, OpCode.QueryAck})
+
+
+def _fmt_ts() -> str:
+    # what datetime.now().isoformat(" ", "microseconds") prints, without
+    # building a datetime for every log line
+    sec, ns = divmod(time.time_ns(), 1_000_000_000)
+    date = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(sec))
+    return f"{date}.{ns // 1000:06d}"
 
 
 class Frame:
-    BeginCode: int = 0xA0
+    __slots__ = ("addr", "opcode", "_wire", "_chk")
+
+    BeginCode: ClassVar[int] = 0xA0
+    # (addr, opcode) -> wire bytes, filled lazily; the frame space is tiny
+    _WIRE: ClassVar[Dict[Tuple[int, int], bytes]] = {}
+    # same keys, rendered on first __str__ so unlogged frames never format
+    _STR: ClassVar[Dict[Tuple[int, int], str]] = {}
 
-    def __init__(self, opcode: OpCode = OpCode.On, addr: int = 0x01):
+    def __init__(self, opcode: OpCode = OpCode.On, addr: int = 0x01) -> None:
         assert opcode != OpCode.Unknown
-        self.addr = addr
-        self.opcode = opcode
+        self.addr: int = addr
+        self.opcode: OpCode = opcode
+        key = (addr, opcode)
+        wire = self._WIRE.get(key)
+        if wire is None:
+            chk = (self.BeginCode + addr + opcode) & 0xFF
+            wire = self._WIRE.setdefault(
+                key, bytes([self.BeginCode, addr, opcode, chk])
+            )
+        self._wire: bytes = wire
+        self._chk: int = wire[3]
 
     def chksum(self) -> int:
-        return (self.BeginCode + self.addr + self.opcode.value) & 0xFF
+        return self._chk
 
     def __str__(self) -> str:
-        return f"Frame {{ addr: {self.addr:02x}, op: {self.opcode.name}, chksum: {self.chksum():02x} }}"
+        key = (self.addr, self.opcode)
+        s = self._STR.get(key)
+        if s is None:
+            s = self._STR.setdefault(
+                key,
+                f"Frame {{ addr: {self.addr:02x}, op: {self.opcode.name}, "
+                f"chksum: {self._chk:02x} }}",
+            )
+        return s
 
     def toBytes(self) -> bytes:
-        return bytes([self.BeginCode, self.addr, self.opcode.value, self.chksum()])
-
-    @staticmethod
-    def fromBytes(data: bytes) -> "Frame":
-        self = Frame(OpCode(data[2]), data[1])
-        if self.toBytes() != data:
-            raise RuntimeError(f"Invalid Frame Data: {data}")
-        return self
+        return self._wire
 
-    def transfer(self, ser: serial.Serial, log: bool = False) -> Optional["Frame"]:
-        ser.write(self.toBytes())
-        if log:
-            print(
-                f"{Color.Time}{datetime.now().isoformat(' ', 'microseconds')}{Color.Info} send {self}{Color.Reset}"
-            )
-        match self.opcode:
-            case OpCode.Off | OpCode.On:
-                return None
-        ack_bytes = ser.read(4)
+    @classmethod
+    def fromBytes(cls, data: bytes) -> "Frame":
+        if (
+            len(data) != 4
+            or data[0] != cls.BeginCode
+            or data[2] not in _OP_BY_VAL
+            or (cls.BeginCode + data[1] + data[2]) & 0xFF != data[3]
+        ):
+            raise RuntimeError(f"Invalid Frame Data: {data!r}")
+        return cls(_OP_BY_VAL[data[2]], data[1])
+
+    def _log(self, verb: str) -> None:
+        sys.stdout.write(_TIME + _fmt_ts() + _INFO + verb + str(self) + _RESET + "\n")
+
+    def _ack(self, ack_bytes: bytes, log: bool) -> "Frame":
         if not ack_bytes:
             raise RuntimeError(f"Serial not supports {self.opcode.name}")
         ack = self.fromBytes(ack_bytes)
         if log:
-            print(
-                f"{Color.Time}{datetime.now().isoformat(' ', 'microseconds')}{Color.Info} recv {ack}{Color.Reset}"
-            )
+            ack._log(" recv ")
         return ack
 
-
-class Feature(Enum):
+    def transfer(self, ser: "serial.Serial", log: bool = False) -> Optional["Frame"]:
+        ser.write(self._wire)
+        if log:
+            self._log(" send ")
+        if self.opcode in _NO_ACK:
+            return None
+        return self._ack(ser.read(4), log)
+
+    def transfer_fd(
+        self, fd: int, log: bool = False, timeout: float = _TIMEOUT
+    ) -> Optional["Frame"]:
+        # same as transfer, but straight on the tty descriptor of an opened
+        # serial port, skipping pyserial's per-call bookkeeping
+        _write_fd(fd, self._wire)
+        if log:
+            self._log(" send ")
+        if self.opcode in _NO_ACK:
+            return None
+        return self._ack(_read_fd(fd, 4, timeout), log)
+
+
+def _read_fd(fd: int, size: int, timeout: float) -> bytes:
+    # like serial.Serial.read: up to size bytes, fewer on timeout
+    data = b""
+    deadline = time.monotonic() + timeout
+    while len(data) < size:
+        remain = deadline - time.monotonic()
+        if remain <= 0 or not select.select([fd], [], [], remain)[0]:
+            break
+        chunk = os.read(fd, size - len(data))
+        if not chunk:
+            # readable but nothing to read: the device went away
+            raise RuntimeError("Serial device disconnected")
+        data += chunk
+    return data
+
+
+def _write_fd(fd: int, data: bytes) -> None:
+    # like serial.Serial.write: the port is opened O_NONBLOCK, so wait for
+    # room and keep going until every byte is out
+    view = memoryview(data)
+    while view:
+        try:
+            # bound first: mypyc evaluates a slice start expression twice
+            n = os.write(fd, view)
+        except BlockingIOError:
+            n = 0
+        view = view[n:]
+        if view:
+            select.select([], [fd], [])
+
+
+class Feature(IntEnum):
     Ack = auto()
     Dummy = auto()
+    StateCache = auto()
 
     @classmethod
-    def parser(cls):
-        def f(s: str):
-            for item in list(cls):
-                if s == item.name:
-                    return item
-            raise RuntimeError(f"Unable to parse {s} as {cls.__name__}")
+    def parser(cls) -> Callable[[str], "Feature"]:
+        return _member_parser(cls.__members__, cls.__name__)
+
+
+def _member_parser(
+    members: Mapping[str, Feature], name: str
+) -> Callable[[str], Feature]:
+    # module level rather than nested in the classmethod, mypyc can't
+    # build closures there
+    def f(s: str) -> Feature:
+        try:
+            return members[s]
+        except KeyError:
+            raise RuntimeError(f"Unable to parse {s} as {name}") from None
+
+    return f
 
-        return f
+
+# not on Windows, where XDG_RUNTIME_DIR is unlikely to be set anyway
+_O_NOFOLLOW: int = getattr(os, "O_NOFOLLOW", 0)
+
+
+def _state_path(port: str, addr: int) -> Optional[str]:
+    # per-user tmpfs (/run/user/$UID), so the cache doesn't survive a reboot;
+    # no cache at all without it, a shared temp dir is open to other users
+    run = os.environ.get("XDG_RUNTIME_DIR")
+    if not run or not os.path.isdir(run):
+        return None
+    from urllib.parse import quote
+
+    return os.path.join(run, f"usb2serial-{quote(port, safe='')}-{addr}.state")
 
 
 class Switch:
+    __slots__ = (
+        "port",
+        "addr",
+        "baudrate",
+        "log",
+        "features",
+        "ser",
+        "status",
+        "_fd",
+        "_state",
+    )
+
     def __init__(
         self,
         port: str,
@@ -95,102 +240,316 @@ class Switch:
         baudrate: int = 9600,
         log: bool = False,
         features: Set[Feature] = set(),
-    ):
-        self.port = port
-        self.addr = addr
-        self.baudrate = baudrate
-        self.log = log
-        self.features = features
-        self.ser = serial.Serial(port, baudrate, timeout=0.5)
-        self.status = OpCode.Unknown
-        if Feature.Ack in self.features:
-            self._transfer(OpCode.QueryAck)
+    ) -> None:
+        self.port: str = port
+        self.addr: int = addr
+        self.baudrate: int = baudrate
+        self.log: bool = log
+        self.features: Set[Feature] = features
+        # deferred so that `--help` and argument errors don't pay for pyserial
+        import serial
+
+        self.ser: serial.Serial = serial.Serial(port, baudrate, timeout=_TIMEOUT)
+        try:
+            self._fd: Optional[int] = self.ser.fileno()
+        except (AttributeError, OSError):
+            # no raw descriptor (ie. on Windows), stay on pyserial
+            self._fd = None
+        # queried lazily by get_status, on/off don't need it to be known
+        self.status: OpCode = OpCode.Unknown
+        self._state: Optional[str] = None
+        if Feature.StateCache in self.features:
+            self._state = _state_path(port, addr)
+            if self._state is not None:
+                self._load_status(self._state)
         if self.log:
-            print(f"{Color.Debug}{self} init{Color.Reset}")
+            sys.stdout.write(_DEBUG + str(self) + " init" + _RESET + "\n")
 
-    def __del__(self):
+    def __del__(self) -> None:
         if hasattr(self, "ser"):
             self.ser.close()
             if self.log:
-                print(f"{Color.Debug}{self} del{Color.Reset}")
+                sys.stdout.write(_DEBUG + str(self) + " del" + _RESET + "\n")
 
-    def __str__(self):
+    def __str__(self) -> str:
         return f"Switch({self.port}:{self.addr}, {self.baudrate}, {self.status.name})"
 
-    def _transfer(self, opcode: OpCode):
-        ack = Frame(opcode, self.addr).transfer(self.ser, self.log)
-        match opcode:
-            case OpCode.Off | OpCode.OffAck:
-                self.status = OpCode.Off
-            case OpCode.On | OpCode.OnAck:
-                self.status = OpCode.On
-            case OpCode.NegateAck | OpCode.QueryAck:
-                if ack:
-                    self.status = ack.opcode
-                else:
-                    raise RuntimeError("unreacheable")
+    def _load_status(self, path: str) -> None:
+        try:
+            fd = os.open(path, os.O_RDONLY | _O_NOFOLLOW)
+        except OSError:
+            return
+        try:
+            if hasattr(os, "getuid") and os.fstat(fd).st_uid != os.getuid():
+                return
+            data = os.read(fd, 1)
+        except OSError:
+            return
+        finally:
+            os.close(fd)
+        if data and data[0] in _OP_BY_VAL:
+            op = _OP_BY_VAL[data[0]]
+            if op in _SET_OFF or op in _SET_ON:
+                self.status = op
+
+    def _save_status(self, path: str) -> None:
+        # best effort, a missing cache only costs a serial write next time
+        try:
+            fd = os.open(
+                path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | _O_NOFOLLOW, 0o600
+            )
+        except OSError:
+            return
+        try:
+            os.write(fd, bytes([self.status]))
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    def _set_status(self, status: OpCode) -> None:
+        if status != self.status:
+            self.status = status
+            if self._state is not None:
+                self._save_status(self._state)
+
+    def _transfer(self, opcode: OpCode) -> None:
+        frame = Frame(opcode, self.addr)
+        if self._fd is not None:
+            ack = frame.transfer_fd(self._fd, self.log)
+        else:
+            ack = frame.transfer(self.ser, self.log)
+        if opcode in _SET_OFF:
+            self._set_status(OpCode.Off)
+        elif opcode in _SET_ON:
+            self._set_status(OpCode.On)
+        elif opcode in _SET_ACK:
+            if ack:
+                self._set_status(ack.opcode)
+            else:
+                raise RuntimeError("unreacheable")
+
+    def _send_fd(self, fd: int, *frames: Frame) -> None:
+        # unacked frames only, written back to back in one go
+        _write_fd(fd, b"".join([frame.toBytes() for frame in frames]))
+        if self.log:
+            for frame in frames:
+                frame._log(" send ")
 
-    def _require(self, feature: Feature):
+    def _require(self, feature: Feature) -> None:
         if feature not in self.features:
             raise RuntimeError(f"Require feature {feature.name}")
 
-    def get_status(self):
+    def get_status(self) -> str:
+        # always ask the device when it can answer, the cached status is only
+        # good enough to skip a redundant on/off
+        if Feature.Ack in self.features:
+            self._transfer(OpCode.QueryAck)
         return self.status.name
 
-    def on(self):
-        if self.status != OpCode.On:
+    def on(self) -> None:
+        if self.status not in _SET_ON:
             self._transfer(OpCode.On)
 
-    def off(self):
-        if self.status != OpCode.Off:
+    def off(self) -> None:
+        if self.status not in _SET_OFF:
             self._transfer(OpCode.Off)
 
-    def toggle(self):
+    def toggle(self) -> None:
         self._require(Feature.Ack)
         self._transfer(OpCode.NegateAck)
 
-    def reset(self, delay: float = 1, reverse: bool = False):
-        self.on() if reverse else self.off()
-        time.sleep(delay)
-        self.off() if reverse else self.on()
+    def reset(self, delay: float = 1, reverse: bool = False) -> None:
+        first, second = (OpCode.On, OpCode.Off) if reverse else (OpCode.Off, OpCode.On)
+        # unconditional, a reset must pulse whatever the cached status is
+        if self._fd is None:
+            self._transfer(first)
+            time.sleep(delay)
+            self._transfer(second)
+            return
+        # On/Off are never acked, so both frames are built up front and only
+        # the bare writes are left around the sleep
+        head, tail = Frame(first, self.addr), Frame(second, self.addr)
+        if delay <= 1e-3:
+            self._send_fd(self._fd, head, tail)
+        else:
+            self._send_fd(self._fd, head)
+            # recorded before the sleep, as _transfer does, so an interrupted
+            # reset leaves the cache matching the relay
+            self._set_status(first)
+            time.sleep(delay)
+            self._send_fd(self._fd, tail)
+        self._set_status(second)
+
+
+USAGE = f"""\
+usage: switch.py [-h] -p PORT [-b BAUDRATE] [-a ADDR] [-l] [--traceback]
+                 [--feature FEATURE] {{on,off,toggle,reset,status}} ...
+
+USB2Serial Switch
+
+positional arguments:
+  {{on,off,toggle,reset,status}}
+                        Action to do
+    reset [-d DELAY] [-r]
+                        -d, --delay DELAY: Delay in seconds (default 1)
+                        -r, --reverse: Reverse reset
+
+options:
+  -h, --help            show this help message and exit
+  -p PORT, --port PORT  Serial port, ie. /dev/ttyUSB0
+  -b BAUDRATE, --baudrate BAUDRATE
+                        Baudrate
+  -a ADDR, --addr ADDR  Address [1, 0xFF)
+  -l, --log             Log
+  --traceback           Enable Python traceback
+  --feature FEATURE     Support features {set(Feature.__members__.keys())}
+"""
+
+ACTIONS = ("on", "off", "toggle", "reset", "status")
+
+
+_OptionTable = Dict[str, Tuple[str, Optional[Callable[[str], Any]]]]
+
+
+def _usage_error(msg: str) -> NoReturn:
+    sys.stderr.write(USAGE.split("\n\n", 1)[0] + "\n")
+    sys.stderr.write(f"switch.py: error: {msg}\n")
+    sys.exit(2)
+
+
+def _long_option(opt: str, table: _OptionTable) -> str:
+    # argparse's allow_abbrev: a unique prefix names the full option
+    names = [*table, "--help"]
+    if opt in names or len(opt) <= 2:
+        return opt
+    matches = [name for name in names if name.startswith(opt)]
+    if len(matches) > 1:
+        _usage_error(f"ambiguous option: {opt} could match {', '.join(matches)}")
+    return matches[0] if matches else opt
+
+
+def _looks_like_option(arg: str) -> bool:
+    # argparse won't take these as a value: anything dash-led except a bare
+    # "-" and negative numbers (-1, -1.5, -.5)
+    if len(arg) < 2 or arg[0] != "-":
+        return False
+    whole, dot, frac = arg[1:].partition(".")
+    if dot:
+        return not (frac.isdigit() and (not whole or whole.isdigit()))
+    return not whole.isdigit()
+
+
+def _split_option(arg: str, table: _OptionTable) -> List[Tuple[str, Optional[str]]]:
+    # one argv word -> (option, attached value) pairs, accepting the forms
+    # argparse does: --opt=VALUE, -oVALUE, -o=VALUE and clustered -lo VALUE
+    if arg.startswith("--"):
+        opt, eq, value = arg.partition("=")
+        return [(_long_option(opt, table), value if eq else None)]
+    if not arg.startswith("-") or len(arg) <= 2:
+        return [(arg, None)]
+    pairs: List[Tuple[str, Optional[str]]] = []
+    rest = arg[1:]
+    while rest:
+        opt, rest = "-" + rest[0], rest[1:]
+        if opt == "-h" or opt not in table:
+            # help exits, anything unknown is reported with what follows it
+            pairs.append((opt if opt == "-h" else opt + rest, None))
+            break
+        if table[opt][1] is None:
+            pairs.append((opt, None))
+            continue
+        # the remainder is the value, or it comes from the next word
+        pairs.append((opt, (rest[1:] if rest[0] == "=" else rest) if rest else None))
+        break
+    return pairs
+
+
+def parse_args(argv: List[str]) -> SimpleNamespace:
+    # hand-rolled instead of argparse: the grammar is fixed and small, and
+    # argparse setup dominates the runtime of a single-shot invocation
+    args = SimpleNamespace(
+        port=None,
+        baudrate=9600,
+        addr=1,
+        log=False,
+        traceback=False,
+        feature=[],
+        action=None,
+        delay=1.0,
+        reverse=False,
+    )
+    # option -> (dest, converter); converter None means a store_true flag
+    options: _OptionTable = {
+        "-p": ("port", str),
+        "--port": ("port", str),
+        "-b": ("baudrate", int),
+        "--baudrate": ("baudrate", int),
+        "-a": ("addr", int),
+        "--addr": ("addr", int),
+        "-l": ("log", None),
+        "--log": ("log", None),
+        "--traceback": ("traceback", None),
+        "--feature": ("feature", Feature.parser()),
+    }
+    reset_options: _OptionTable = {
+        "-d": ("delay", float),
+        "--delay": ("delay", float),
+        "-r": ("reverse", None),
+        "--reverse": ("reverse", None),
+    }
+
+    it = iter(argv)
+    for arg in it:
+        # like subparsers: global options go before the action, its own after
+        if args.action is None:
+            table = options
+        else:
+            table = reset_options if args.action == "reset" else {}
+        for opt, value in _split_option(arg, table):
+            if opt in ("-h", "--help"):
+                sys.stdout.write(USAGE)
+                sys.exit(0)
+            if opt in table:
+                dest, conv = table[opt]
+                if conv is None:
+                    if value is not None:
+                        _usage_error(
+                            f"argument {opt}: ignored explicit argument {value!r}"
+                        )
+                    setattr(args, dest, True)
+                    continue
+                if value is None:
+                    value = next(it, None)
+                    if value is None or _looks_like_option(value):
+                        _usage_error(f"argument {opt}: expected one argument")
+                try:
+                    converted = conv(value)
+                except (ValueError, RuntimeError):
+                    _usage_error(f"argument {opt}: invalid value: {value!r}")
+                if dest == "feature":
+                    args.feature.append(converted)
+                else:
+                    setattr(args, dest, converted)
+            elif args.action is None and opt in ACTIONS:
+                args.action = opt
+            elif args.action is None and not opt.startswith("-"):
+                choices = ", ".join(ACTIONS)
+                _usage_error(
+                    f"argument action: invalid choice: {opt!r} (choose from {choices})"
+                )
+            else:
+                _usage_error(f"unrecognized arguments: {opt}")
+
+    if args.port is None:
+        _usage_error("the following arguments are required: -p/--port")
+    if args.action is None:
+        _usage_error("the following arguments are required: action")
+    return args
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="USB2Serial Switch")
-    parser.add_argument(
-        "-p", "--port", help="Serial port, ie. /dev/ttyUSB0", required=True
-    )
-    parser.add_argument("-b", "--baudrate", help="Baudrate", default=9600)
-    parser.add_argument("-a", "--addr", type=int, help="Address [1, 0xFF)", default=1)
-    parser.add_argument("-l", "--log", help="Log", action="store_true")
-    parser.add_argument(
-        "--traceback", help="Enable Python traceback", action="store_true"
-    )
-    parser.register("type", "Feature", Feature.parser())
-    parser.add_argument(
-        "--feature",
-        help=f"Support features {set(Feature.__members__.keys())}",
-        action="append",
-        type="Feature",
-        default=[],
-    )
-    action = parser.add_subparsers(help="Action to do", required=True, dest="action")
-    action.add_parser("on")
-    action.add_parser("off")
-    action.add_parser("toggle")
-    action_reset = action.add_parser("reset")
-    action_reset.add_argument(
-        "-d",
-        "--delay",
-        help="Delay in seconds",
-        type=float,
-        default=1,
-    )
-    action_reset.add_argument(
-        "-r", "--reverse", help="Reverse reset", action="store_true"
-    )
-    action.add_parser("status")
-    args = parser.parse_args()
+    args = parse_args(sys.argv[1:])
 
     if not args.traceback:
         sys.tracebacklimit = 0